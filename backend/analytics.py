@@ -0,0 +1,337 @@
+"""
+Class analytics over duel_attempts for Novlearn API
+
+Attempts are loaded page by page (keyset cursor on id) into columnar NumPy
+arrays, and per-exercise / per-element statistics are computed with grouped
+vectorised operations: correctness rate, time_spent percentiles and IQR
+outliers. Loaded columns are cached per player, so overlapping player sets
+share them, and refreshed incrementally from the last loaded attempt id.
+Refreshes re-read a window of ids below it: ids are allocated before their
+transaction commits, so a lower id can become visible after a higher one.
+"""
+import threading
+import time
+from collections import OrderedDict
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from supabase import Client
+
+from config import settings
+
+PERCENTILES = (50, 90, 95)
+
+# Outliers: outside [Q1 - k*IQR, Q3 + k*IQR]
+IQR_FACTOR = 1.5
+
+# Sentinel for attempts whose duel has no exercise (ON DELETE SET NULL)
+NO_EXERCISE = -1
+
+
+class AttemptColumns:
+    """Columnar storage of duel attempts"""
+    __slots__ = ("ids", "exercise_ids", "element_ids", "is_correct", "time_spent")
+
+    def __init__(self, ids, exercise_ids, element_ids, is_correct, time_spent):
+        self.ids = ids
+        self.exercise_ids = exercise_ids
+        self.element_ids = element_ids
+        self.is_correct = is_correct
+        self.time_spent = time_spent
+
+    @classmethod
+    def empty(cls) -> "AttemptColumns":
+        return cls(
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=bool),
+            np.empty(0, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_rows(cls, rows: List[dict]) -> "AttemptColumns":
+        """Build columns from a page of `duel_attempts` rows"""
+        return cls(
+            np.fromiter((row["id"] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter(
+                ((row.get("duel") or {}).get("exercise_id") or NO_EXERCISE for row in rows),
+                dtype=np.int64, count=len(rows),
+            ),
+            np.fromiter((row["element_id"] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((bool(row["is_correct"]) for row in rows), dtype=bool, count=len(rows)),
+            np.fromiter(
+                (np.nan if row.get("time_spent") is None else row["time_spent"] for row in rows),
+                dtype=np.float64, count=len(rows),
+            ),
+        )
+
+    @classmethod
+    def concat(cls, parts: List["AttemptColumns"]) -> "AttemptColumns":
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in cls.__slots__))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def last_id(self) -> int:
+        return int(self.ids.max()) if len(self.ids) else 0
+
+    def take(self, mask: np.ndarray) -> "AttemptColumns":
+        return AttemptColumns(*(getattr(self, name)[mask] for name in self.__slots__))
+
+
+def load_attempts(supabase: Client, player_ids: List[str], after_id: int = 0) -> Dict[str, AttemptColumns]:
+    """Load attempts of the given players with id > after_id, page by page, split per player"""
+    parts: Dict[str, List[AttemptColumns]] = defaultdict(list)
+    last_id = after_id
+
+    while True:
+        result = supabase.table("duel_attempts")\
+            .select("id, player_id, element_id, is_correct, time_spent, duel:duel_id(exercise_id)")\
+            .in_("player_id", player_ids)\
+            .gt("id", last_id)\
+            .order("id")\
+            .limit(settings.analytics_page_size)\
+            .execute()
+        rows = result.data or []
+        if not rows:
+            break
+
+        # Only the compact arrays are kept, each page of dicts is dropped
+        by_player: Dict[str, List[dict]] = defaultdict(list)
+        for row in rows:
+            by_player[row["player_id"]].append(row)
+        for player_id, player_rows in by_player.items():
+            parts[player_id].append(AttemptColumns.from_rows(player_rows))
+        # Stop on an empty page only: PostgREST caps responses at its
+        # max-rows setting, which may be below analytics_page_size
+        last_id = rows[-1]["id"]
+
+    return {player_id: AttemptColumns.concat(player_parts) for player_id, player_parts in parts.items()}
+
+
+def _group_percentiles(
+    values: np.ndarray,
+    inverse: np.ndarray,
+    n_groups: int,
+    quantiles: Iterable[float],
+    value_order: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-group percentiles (linear interpolation, like np.percentile) of the
+    non-NaN values. value_order (np.argsort(values)) can be shared between
+    groupings of the same values. Returns (array of shape
+    [len(quantiles), n_groups], counts).
+    """
+    if value_order is None:
+        value_order = np.argsort(values)
+    # NaN sort last: drop them
+    order = value_order[:np.count_nonzero(~np.isnan(values))]
+
+    # Sort by group, then by value inside each group: a stable sort on the
+    # group ids keeps the value order (radix sort when ids fit in 16 bits)
+    group_ids = inverse.astype(np.uint16) if n_groups <= np.iinfo(np.uint16).max else inverse
+    order = order[np.argsort(group_ids[order], kind="stable")]
+    groups = inverse[order]
+    sorted_vals = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    quantiles = np.asarray(list(quantiles), dtype=np.float64)[:, None]
+    pos = quantiles * np.maximum(counts - 1, 0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    frac = pos - lo
+
+    if len(sorted_vals) == 0:
+        return np.full((len(quantiles), n_groups), np.nan), counts
+
+    # Empty groups point at index 0 and are masked below
+    lo_vals = sorted_vals[np.minimum(starts + lo, len(sorted_vals) - 1)]
+    hi_vals = sorted_vals[np.minimum(starts + hi, len(sorted_vals) - 1)]
+    result = lo_vals + (hi_vals - lo_vals) * frac
+    result[:, counts == 0] = np.nan
+    return result, counts
+
+
+def _factorize(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (unique_keys, inverse) like np.unique(keys, return_inverse=True), in
+    linear time with a lookup table when the key range is compact (ids)
+    """
+    low, high = int(keys.min()), int(keys.max())
+    if high - low > 4 * len(keys) + 1024:
+        return np.unique(keys, return_inverse=True)
+
+    offsets = keys - low
+    present = np.bincount(offsets, minlength=high - low + 1) > 0
+    lookup = np.cumsum(present) - 1
+    return np.flatnonzero(present) + low, lookup[offsets]
+
+
+def grouped_stats(
+    keys: np.ndarray,
+    is_correct: np.ndarray,
+    time_spent: np.ndarray,
+    time_order: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Statistics per group of rows sharing the same integer key. Composite keys
+    must be packed into one int64 column first (np.unique on 2-D arrays
+    falls back to a much slower structured sort).
+    """
+    if len(is_correct) == 0:
+        return {"keys": keys[:0], "attempts": np.empty(0, dtype=np.int64)}
+
+    unique_keys, inverse = _factorize(keys)
+    n_groups = len(unique_keys)
+
+    attempts = np.bincount(inverse, minlength=n_groups)
+    correct = np.bincount(inverse, weights=is_correct, minlength=n_groups)
+
+    (p25, p75, *percentiles), timed = _group_percentiles(
+        time_spent, inverse, n_groups, (0.25, 0.75, *(p / 100 for p in PERCENTILES)), time_order
+    )
+    iqr = p75 - p25
+    low_bound = p25 - IQR_FACTOR * iqr
+    high_bound = p75 + IQR_FACTOR * iqr
+    # NaN comparisons are False: untimed attempts are never outliers
+    outlier = (time_spent < low_bound[inverse]) | (time_spent > high_bound[inverse])
+
+    stats = {
+        "keys": unique_keys,
+        "attempts": attempts,
+        "correct": correct.astype(np.int64),
+        "correct_rate": correct / attempts,
+        "timed_attempts": timed,
+        "time_mean": np.bincount(inverse, weights=np.nan_to_num(time_spent), minlength=n_groups) / np.maximum(timed, 1),
+        "outliers": np.bincount(inverse, weights=outlier, minlength=n_groups).astype(np.int64),
+        "outlier_low_ms": low_bound,
+        "outlier_high_ms": high_bound,
+    }
+    stats["time_mean"][timed == 0] = np.nan
+    for p, values in zip(PERCENTILES, percentiles):
+        stats[f"time_p{p}"] = values
+    return stats
+
+
+def _json_column(values: np.ndarray) -> list:
+    """NumPy column -> JSON values (NaN -> None, floats rounded)"""
+    if values.dtype.kind != "f":
+        return values.tolist()
+    return [None if value != value else round(value, 4) for value in values.tolist()]
+
+
+def _stats_to_rows(stats: Dict[str, np.ndarray], key_columns: List[Tuple[str, np.ndarray]]) -> List[dict]:
+    """Convert grouped arrays to one JSON-friendly dict per group"""
+    columns = {name: values.tolist() for name, values in key_columns}
+    if "exercise_id" in columns:
+        columns["exercise_id"] = [None if value == NO_EXERCISE else value for value in columns["exercise_id"]]
+    for name, values in stats.items():
+        if name != "keys":
+            columns[name] = _json_column(values)
+
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def compute_class_analytics(columns: AttemptColumns, exercise_id: Optional[int] = None) -> dict:
+    """Per-exercise and per-(exercise, element) statistics"""
+    if exercise_id is not None:
+        mask = columns.exercise_ids == exercise_id
+        columns = columns.take(mask)
+
+    # One value sort shared by both groupings
+    time_order = np.argsort(columns.time_spent)
+    per_exercise = grouped_stats(columns.exercise_ids, columns.is_correct, columns.time_spent, time_order)
+
+    # Pack (exercise_id, element_id) into one int64 key
+    element_offset = int(columns.element_ids.min()) if len(columns) else 0
+    radix = int(columns.element_ids.max()) - element_offset + 1 if len(columns) else 1
+    per_element = grouped_stats(
+        columns.exercise_ids * radix + (columns.element_ids - element_offset),
+        columns.is_correct,
+        columns.time_spent,
+        time_order,
+    )
+    exercise_keys, element_keys = np.divmod(per_element["keys"], radix)
+
+    return {
+        "attempts": len(columns),
+        "exercises": _stats_to_rows(per_exercise, [("exercise_id", per_exercise["keys"])]),
+        "elements": _stats_to_rows(per_element, [
+            ("exercise_id", exercise_keys),
+            ("element_id", element_keys + element_offset),
+        ]),
+    }
+
+
+class AnalyticsCache:
+    """Loaded attempt columns per player (LRU), refreshed incrementally"""
+
+    def __init__(self, max_players: int, refresh_interval: float, refresh_overlap: int):
+        self._max_players = max_players
+        self._refresh_interval = refresh_interval
+        self._refresh_overlap = refresh_overlap
+        # player id -> (columns, last refresh time, highest id seen by the
+        # queries that included the player, even if none of the rows were theirs)
+        self._entries: "OrderedDict[str, Tuple[AttemptColumns, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _merge(self, player_id: str, new: AttemptColumns, now: float, seen_id: int) -> None:
+        """Append newly loaded attempts, skipping ids already cached (re-read window)"""
+        with self._lock:
+            entry = self._entries.get(player_id)
+            cached = entry[0] if entry is not None else AttemptColumns.empty()
+            if len(new) and len(cached):
+                new = new.take(~np.isin(new.ids, cached.ids))
+            columns = AttemptColumns.concat([cached, new]) if len(new) else cached
+            seen_id = max(seen_id, entry[2]) if entry is not None else seen_id
+            self._entries[player_id] = (columns, now, seen_id)
+            self._entries.move_to_end(player_id)
+
+    def get_columns(self, supabase: Client, player_ids: List[str]) -> AttemptColumns:
+        now = time.monotonic()
+
+        missing, stale = [], []
+        with self._lock:
+            for player_id in set(player_ids):
+                entry = self._entries.get(player_id)
+                if entry is None:
+                    missing.append(player_id)
+                    continue
+                self._entries.move_to_end(player_id)
+                if now - entry[1] >= self._refresh_interval:
+                    stale.append(player_id)
+            after_id = min((self._entries[player_id][2] for player_id in stale), default=0)
+
+        # One query for new players, one for the refresh of stale ones
+        loads = []
+        if missing:
+            loads.append((missing, 0))
+        if stale:
+            loads.append((stale, max(after_id - self._refresh_overlap, 0)))
+        for players, since_id in loads:
+            loaded = load_attempts(supabase, players, after_id=since_id)
+            seen_id = max((columns.last_id for columns in loaded.values()), default=since_id)
+            for player_id in players:
+                self._merge(player_id, loaded.get(player_id, AttemptColumns.empty()), now, seen_id)
+
+        with self._lock:
+            parts = [self._entries[player_id][0] for player_id in set(player_ids) if player_id in self._entries]
+            while len(self._entries) > self._max_players:
+                self._entries.popitem(last=False)
+        return AttemptColumns.concat([part for part in parts if len(part)])
+
+
+analytics_cache = AnalyticsCache(
+    settings.analytics_cache_players,
+    settings.analytics_refresh_interval,
+    settings.analytics_refresh_overlap,
+)
@@ -2,8 +2,11 @@
 Authentication utilities for Novlearn API
 """
 from fastapi import HTTPException, Header
+import httpx
 from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
 from config import settings
+from profiling import TimedTransport
 import logging
 from typing import Optional
 
@@ -36,7 +39,19 @@ def _get_supabase_client() -> Client:
                 "SUPABASE_SERVICE_KEY=your-service-key"
             )
         
-        _supabase_client = create_client(settings.supabase_url, settings.supabase_service_key)
+        # One shared HTTP client (PostgREST + Auth) whose transport records
+        # upstream call timings for profiled requests. HTTP/2 and redirects
+        # match the clients postgrest and supabase_auth would build themselves.
+        http_client = httpx.Client(
+            transport=TimedTransport(httpx.HTTPTransport(http2=True)),
+            follow_redirects=True,
+            timeout=settings.supabase_timeout,
+        )
+        _supabase_client = create_client(
+            settings.supabase_url,
+            settings.supabase_service_key,
+            options=SyncClientOptions(httpx_client=http_client)
+        )
     
     return _supabase_client
 
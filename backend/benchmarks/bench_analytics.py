@@ -0,0 +1,141 @@
+"""
+Benchmark of the class analytics engine on synthetic duel_attempts data
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_analytics [rows]
+
+Compares the vectorised engine with a plain Python loop computing the same
+output (per-exercise and per-element groups, correctness, mean, p50/p90/p95,
+IQR outlier bounds and counts; checked equal on the sample). The loop runs on
+a sample and is extrapolated. Also times the conversion of API pages into
+columns.
+"""
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from analytics import IQR_FACTOR, PERCENTILES, AttemptColumns, compute_class_analytics
+
+EXERCISES = 200
+ELEMENTS = 8
+LOOP_SAMPLE = 100_000
+
+
+def synthetic_columns(rows: int, seed: int = 42) -> AttemptColumns:
+    rng = np.random.default_rng(seed)
+    time_spent = rng.gamma(2.0, 4000.0, rows)
+    time_spent[rng.random(rows) < 0.01] = np.nan  # some attempts without timing
+    return AttemptColumns(
+        np.arange(1, rows + 1, dtype=np.int64),
+        rng.integers(1, EXERCISES + 1, rows),
+        rng.integers(0, ELEMENTS, rows),
+        rng.random(rows) < 0.65,
+        time_spent,
+    )
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    """Linear interpolation between closest ranks, like np.percentile"""
+    pos = q * (len(sorted_values) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _loop_group_stats(attempts: list) -> dict:
+    times = sorted(a["time_spent"] for a in attempts if a["time_spent"] is not None)
+    correct = sum(a["is_correct"] for a in attempts)
+    stats = {
+        "attempts": len(attempts),
+        "correct": correct,
+        "correct_rate": correct / len(attempts),
+        "timed_attempts": len(times),
+        "time_mean": sum(times) / len(times) if times else None,
+        "outliers": 0,
+        "outlier_low_ms": None,
+        "outlier_high_ms": None,
+    }
+    for p in PERCENTILES:
+        stats[f"time_p{p}"] = _percentile(times, p / 100) if times else None
+    if times:
+        q1, q3 = _percentile(times, 0.25), _percentile(times, 0.75)
+        low, high = q1 - IQR_FACTOR * (q3 - q1), q3 + IQR_FACTOR * (q3 - q1)
+        stats["outliers"] = sum(1 for t in times if t < low or t > high)
+        stats["outlier_low_ms"], stats["outlier_high_ms"] = low, high
+    return stats
+
+
+def python_loop_stats(rows: list) -> dict:
+    """Reference implementation with dicts and sorted lists, same output as the engine"""
+    per_exercise = defaultdict(list)
+    per_element = defaultdict(list)
+    for row in rows:
+        per_exercise[row["exercise_id"]].append(row)
+        per_element[(row["exercise_id"], row["element_id"])].append(row)
+
+    return {
+        "attempts": len(rows),
+        "exercises": {key: _loop_group_stats(attempts) for key, attempts in per_exercise.items()},
+        "elements": {key: _loop_group_stats(attempts) for key, attempts in per_element.items()},
+    }
+
+
+def check_same_output(engine: dict, loop: dict) -> None:
+    """Fail loudly if the two implementations disagree (rounding aside)"""
+    assert engine["attempts"] == loop["attempts"]
+    for name, key_columns in (("exercises", ("exercise_id",)), ("elements", ("exercise_id", "element_id"))):
+        assert len(engine[name]) == len(loop[name])
+        for row in engine[name]:
+            key = tuple(row[column] for column in key_columns)
+            expected = loop[name][key if len(key) > 1 else key[0]]
+            for stat, value in expected.items():
+                if value is None or row[stat] is None:
+                    assert value is None and row[stat] is None, (name, key, stat)
+                else:
+                    assert abs(row[stat] - value) <= 1e-3 * max(1.0, abs(value)), (name, key, stat, row[stat], value)
+
+
+def main(rows: int) -> None:
+    columns = synthetic_columns(rows)
+    print(f"{rows:,} attempts, {EXERCISES} exercises x {ELEMENTS} elements")
+
+    started = time.perf_counter()
+    result = compute_class_analytics(columns)
+    vectorised_s = time.perf_counter() - started
+    print(f"vectorised engine:        {vectorised_s * 1000:8.1f} ms ({len(result['elements'])} element groups)")
+
+    sample = min(rows, LOOP_SAMPLE)
+    sample_rows = [
+        {
+            "exercise_id": int(columns.exercise_ids[i]),
+            "element_id": int(columns.element_ids[i]),
+            "is_correct": bool(columns.is_correct[i]),
+            "time_spent": None if np.isnan(columns.time_spent[i]) else float(columns.time_spent[i]),
+        }
+        for i in range(sample)
+    ]
+    started = time.perf_counter()
+    loop_result = python_loop_stats(sample_rows)
+    loop_s = (time.perf_counter() - started) * rows / sample
+    check_same_output(compute_class_analytics(AttemptColumns(
+        *(getattr(columns, name)[:sample] for name in AttemptColumns.__slots__)
+    )), loop_result)
+    print(f"python loop (estimated):  {loop_s * 1000:8.1f} ms (x{loop_s / vectorised_s:.1f})")
+
+    page = [
+        {**row, "id": i + 1, "duel": {"exercise_id": row["exercise_id"]}}
+        for i, row in enumerate(sample_rows[:5000])
+    ]
+    started = time.perf_counter()
+    AttemptColumns.from_rows(page)
+    page_s = time.perf_counter() - started
+    print(f"page -> columns:          {page_s * 1000:8.2f} ms per 5,000-row page")
+
+    sizes = sum(getattr(columns, name).nbytes for name in AttemptColumns.__slots__)
+    print(f"columns in memory:        {sizes / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
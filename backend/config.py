@@ -1,73 +1,108 @@
 """
 Configuration settings for Novlearn backend
 """
-import os
+import json
+import time
 from pathlib import Path
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from dotenv import load_dotenv
+
+# Reference point for the startup-time budget: config is the first backend
+# module imported, so the budget covers the Supabase import and warm-up.
+BOOT_TIME = time.perf_counter()
 
 # Get the directory where this config.py file is located
 BACKEND_DIR = Path(__file__).parent.resolve()
 ENV_FILE = BACKEND_DIR / ".env"
 
-# Load .env file from backend directory
-if ENV_FILE.exists():
-    load_dotenv(ENV_FILE)
-    print(f"[Config] Loaded .env from: {ENV_FILE}")
-else:
-    # Try loading from current directory as fallback
-    load_dotenv()
-    print(f"[Config] .env not found at {ENV_FILE}, trying current directory")
+# Default values for local development
+DEFAULT_CORS_ORIGINS = [
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+    "https://novlearn.fr",
+    "https://www.novlearn.fr",
+]
 
 
-def _get_cors_origins() -> list[str]:
+def _get_cors_origins(cors_env: str) -> list[str]:
     """
     Parse CORS origins from environment variable or return default values.
     Supports both comma-separated string and JSON array formats.
     """
-    cors_env = os.getenv("CORS_ORIGINS", "")
     if cors_env:
         # Handle comma-separated format from deployment
         if not cors_env.startswith("["):
             return [origin.strip() for origin in cors_env.split(",") if origin.strip()]
         # Handle JSON format (if provided)
-        import json
         try:
             return json.loads(cors_env)
         except json.JSONDecodeError:
             pass
-    
-    # Default values for local development
-    return [
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-        "https://novlearn.fr",
-        "https://www.novlearn.fr",
-    ]
+
+    return list(DEFAULT_CORS_ORIGINS)
 
 
 class Settings(BaseSettings):
+    # Values are read once from the process environment, then from the .env
+    # file of the backend directory (or the current directory as fallback).
+
     # API Settings
-    app_env: str = os.getenv("APP_ENV", "development")
-    debug: bool = os.getenv("DEBUG", "False") == "True"
-    host: str = os.getenv("HOST", "0.0.0.0")
-    port: int = int(os.getenv("PORT", "8010"))
-    
+    app_env: str = "development"
+    debug: bool = False
+    host: str = "0.0.0.0"
+    port: int = 8010
+
     # Supabase Settings
-    supabase_url: str = os.getenv("SUPABASE_URL", "")
-    supabase_service_key: str = os.getenv("SUPABASE_SERVICE_KEY", "")
-    
-    model_config = SettingsConfigDict(env_file=str(ENV_FILE) if ENV_FILE.exists() else ".env", extra="ignore")
+    supabase_url: str = ""
+    supabase_service_key: str = ""
+    supabase_timeout: float = 120.0  # secondes
 
+    # Kept as a raw string: pydantic-settings would try to JSON-decode a list
+    # field, which breaks the comma-separated format used by the deployment.
+    cors_origins_raw: str = Field(default="", validation_alias="CORS_ORIGINS")
 
-settings = Settings()
+    # Startup / readiness
+    warmup_timeout: float = 10.0  # secondes
+    warmup_retry_interval: float = 5.0  # secondes, doublé à chaque échec
+    warmup_retry_max_interval: float = 60.0  # secondes
+    startup_budget_ms: int = 3000
+    ready_probe_timeout: float = 2.0  # secondes
+    default_exercise_ttl: float = 300.0  # secondes
+
+    # Streaming exports
+    export_page_size: int = 1000
+
+    # Display-name cache (see profiles.py)
+    profile_cache_size: int = 10000
+    profile_cache_ttl: float = 300.0  # secondes
 
-# Log configuration status
-print(f"[Config] SUPABASE_URL: {'SET' if settings.supabase_url else 'NOT SET'}")
-print(f"[Config] SUPABASE_SERVICE_KEY: {'SET' if settings.supabase_service_key else 'NOT SET'}")
-if not settings.supabase_url or not settings.supabase_service_key:
-    print(f"[Config] WARNING: Supabase credentials missing! Check {ENV_FILE}")
+    # Class analytics (see analytics.py)
+    analytics_page_size: int = 5000
+    analytics_cache_players: int = 5000
+    analytics_refresh_interval: float = 30.0  # secondes
+    analytics_refresh_overlap: int = 1000  # ids relus sous le dernier id chargé
 
-# Add cors_origins as a property outside BaseSettings to avoid parsing issues
-# Use object.__setattr__ to bypass Pydantic's field validation
-object.__setattr__(settings, "cors_origins", _get_cors_origins())
+    # Idempotency-Key store (see idempotency.py)
+    idempotency_ttl: float = 86400.0  # secondes
+    idempotency_max_entries: int = 10000
+    idempotency_store_path: str = ""
+
+    # Opt-in profiling (see profiling.py)
+    profiling_admin_token: str = ""
+    profiling_sample_rate: float = 0.0
+    profiling_slow_ms: float = 0.0
+    profiling_dir: str = str(BACKEND_DIR / "profiles")
+    profiling_max_files: int = 50
+
+    model_config = SettingsConfigDict(
+        env_file=str(ENV_FILE) if ENV_FILE.exists() else ".env",
+        extra="ignore",
+        populate_by_name=True,
+    )
+
+    @property
+    def cors_origins(self) -> list[str]:
+        return _get_cors_origins(self.cors_origins_raw)
+
+
+settings = Settings()
@@ -0,0 +1,162 @@
+"""
+Streaming exports (NDJSON / CSV) of duels and duel attempts for Novlearn API
+
+Rows are fetched page by page with a keyset cursor on `id` and yielded as
+soon as they are serialized, so memory use does not depend on the number of
+exported rows. Paging stops on an empty page only: PostgREST caps each
+response at its max-rows setting, so a short page is not always the last.
+"""
+import csv
+import io
+import json
+import logging
+from typing import Iterator, List, Optional
+
+from supabase import Client
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+DUEL_ATTEMPT_COLUMNS = [
+    "id", "duel_id", "exercise_id", "player_id", "element_id",
+    "answer", "is_correct", "time_spent", "submitted_at",
+]
+
+DUEL_COLUMNS = [
+    "id", "exercise_id", "player1_id", "player2_id", "status", "winner_id",
+    "player1_score", "player2_score", "player1_time", "player2_time",
+    "created_at", "started_at", "finished_at",
+]
+
+
+def _iter_duel_attempt_pages(
+    supabase: Client,
+    user_ids: List[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    exercise_id: Optional[int],
+    after_id: int,
+) -> Iterator[List[dict]]:
+    """Yield pages of duel_attempts ordered by id (keyset pagination)"""
+    # Inner join on duels only when filtering by exercise
+    duel_embed = "duel:duel_id!inner(exercise_id)" if exercise_id is not None else "duel:duel_id(exercise_id)"
+    columns = ",".join(c for c in DUEL_ATTEMPT_COLUMNS if c != "exercise_id")
+    last_id = after_id
+
+    while True:
+        query = supabase.table("duel_attempts")\
+            .select(f"{columns}, {duel_embed}")\
+            .in_("player_id", user_ids)\
+            .gt("id", last_id)
+        if date_from:
+            query = query.gte("submitted_at", date_from)
+        if date_to:
+            query = query.lt("submitted_at", date_to)
+        if exercise_id is not None:
+            query = query.eq("duel.exercise_id", exercise_id)
+
+        result = query.order("id").limit(settings.export_page_size).execute()
+        rows = result.data or []
+        if not rows:
+            return
+
+        for row in rows:
+            duel = row.pop("duel", None) or {}
+            row["exercise_id"] = duel.get("exercise_id")
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def _iter_duel_pages(
+    supabase: Client,
+    user_ids: List[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    exercise_id: Optional[int],
+    after_id: int,
+) -> Iterator[List[dict]]:
+    """Yield pages of duels involving the given users, ordered by id"""
+    id_list = ",".join(user_ids)
+    last_id = after_id
+
+    while True:
+        query = supabase.table("duels")\
+            .select(",".join(DUEL_COLUMNS))\
+            .or_(f"player1_id.in.({id_list}),player2_id.in.({id_list})")\
+            .gt("id", last_id)
+        if date_from:
+            query = query.gte("created_at", date_from)
+        if date_to:
+            query = query.lt("created_at", date_to)
+        if exercise_id is not None:
+            query = query.eq("exercise_id", exercise_id)
+
+        result = query.order("id").limit(settings.export_page_size).execute()
+        rows = result.data or []
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def _serialize(pages: Iterator[List[dict]], columns: List[str], fmt: str) -> Iterator[str]:
+    """Turn pages of rows into NDJSON lines or CSV chunks (one chunk per page)"""
+    try:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            yield buffer.getvalue()
+            for rows in pages:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                yield buffer.getvalue()
+        else:
+            for rows in pages:
+                yield "".join(
+                    json.dumps({c: row.get(c) for c in columns}, ensure_ascii=False) + "\n"
+                    for row in rows
+                )
+    except Exception as e:
+        # Headers are already sent: mark the NDJSON output as incomplete, then
+        # re-raise so the server aborts the chunked response instead of ending
+        # it cleanly (a truncated file must not look complete)
+        logger.error(f"Export stream aborted: {str(e)}", exc_info=True)
+        if fmt != "csv":
+            yield json.dumps({"error": "Export interrompu", "detail": str(e)}, ensure_ascii=False) + "\n"
+        raise
+
+
+def stream_duel_attempts(
+    supabase: Client,
+    user_ids: List[str],
+    fmt: str = "ndjson",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    exercise_id: Optional[int] = None,
+    after_id: int = 0,
+) -> Iterator[str]:
+    """Stream duel_attempts of the given players as NDJSON or CSV"""
+    pages = _iter_duel_attempt_pages(supabase, user_ids, date_from, date_to, exercise_id, after_id)
+    return _serialize(pages, DUEL_ATTEMPT_COLUMNS, fmt)
+
+
+def stream_duels(
+    supabase: Client,
+    user_ids: List[str],
+    fmt: str = "ndjson",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    exercise_id: Optional[int] = None,
+    after_id: int = 0,
+) -> Iterator[str]:
+    """Stream duels (with results) involving the given players as NDJSON or CSV"""
+    pages = _iter_duel_pages(supabase, user_ids, date_from, date_to, exercise_id, after_id)
+    return _serialize(pages, DUEL_COLUMNS, fmt)
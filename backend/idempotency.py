@@ -0,0 +1,218 @@
+"""
+Idempotency-Key support for Novlearn API write endpoints
+
+A client sends `Idempotency-Key: <unique value>` with a write request. The
+first successful response is stored (per user, endpoint and key); a retry
+with the same key and body gets the stored response back, marked with
+`Idempotent-Replayed: true`, without running the endpoint again.
+
+A request that fails before writing releases its key, so it may be retried.
+Once the endpoint has started writing (`idem.mark_written()`), a failure
+keeps the key as failed: a retry gets 409 instead of running the writes a
+second time, since the first run may have applied part of them.
+
+Entries live in a bounded in-memory store with a TTL. When
+IDEMPOTENCY_STORE_PATH is set, the store is loaded at startup and saved at
+shutdown (single-process deployments; each worker keeps its own store).
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from fastapi import Depends, Header, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from config import settings
+from auth import verify_token
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+# Markers for a key whose first request is still running, or failed after
+# it had started writing
+_IN_FLIGHT = object()
+_FAILED = object()
+
+# Stored status code of failed keys in the persisted store
+FAILED_STATUS = 0
+
+# Seconds a client should wait before retrying a request still in flight
+IN_FLIGHT_RETRY_AFTER = 1
+
+
+class IdempotencyStore:
+    """Bounded LRU of stored responses with TTL eviction"""
+
+    def __init__(self, max_entries: int, ttl: float, path: Optional[str] = None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._path = Path(path) if path else None
+        # key -> (expires_at, fingerprint, status_code, body)
+        self._entries: "OrderedDict[str, Tuple[float, str, int, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries (oldest first) and entries beyond the bound"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now and len(self._entries) <= self._max_entries:
+                break
+            del self._entries[key]
+
+    def begin(self, key: str, fingerprint: str) -> Optional[Tuple[int, object]]:
+        """
+        Claim a key. Returns the stored (status_code, body) for a replay, or
+        None when the caller should run the request and then complete().
+        """
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = (now + self._ttl, fingerprint, 0, _IN_FLIGHT)
+                return None
+
+        _, stored_fingerprint, status_code, body = entry
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key déjà utilisée pour une autre requête")
+        if body is _IN_FLIGHT:
+            raise HTTPException(
+                status_code=409,
+                detail="Requête déjà en cours de traitement",
+                headers={"Retry-After": str(IN_FLIGHT_RETRY_AFTER)},
+            )
+        if body is _FAILED:
+            raise HTTPException(
+                status_code=409,
+                detail="La requête a échoué après avoir commencé à enregistrer : rechargez avant de réessayer",
+            )
+        return status_code, body
+
+    def complete(self, key: str, fingerprint: str, status_code: int, body: object) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self._ttl, fingerprint, status_code, body)
+            self._entries.move_to_end(key)
+
+    def fail(self, key: str, fingerprint: str) -> None:
+        """Keep a key whose request failed after writing, so it is not run again"""
+        with self._lock:
+            self._entries[key] = (time.time() + self._ttl, fingerprint, FAILED_STATUS, _FAILED)
+            self._entries.move_to_end(key)
+
+    def release(self, key: str) -> None:
+        """Forget an in-flight key (the request failed, a retry may run it)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] is _IN_FLIGHT:
+                del self._entries[key]
+
+    def load(self) -> None:
+        if not self._path or not self._path.exists():
+            return
+        try:
+            data = json.loads(self._path.read_text())
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not load idempotency store: {str(e)}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, expires_at, fingerprint, status_code, body in data:
+                if expires_at > now:
+                    if status_code == FAILED_STATUS:
+                        body = _FAILED
+                    self._entries[key] = (expires_at, fingerprint, status_code, body)
+            self._evict(now)
+        logger.info(f"Loaded {len(self._entries)} idempotency keys from {self._path}")
+
+    def save(self) -> None:
+        if not self._path:
+            return
+        with self._lock:
+            self._evict(time.time())
+            data = [
+                [key, expires_at, fingerprint, status_code, None if body is _FAILED else body]
+                for key, (expires_at, fingerprint, status_code, body) in self._entries.items()
+                if body is not _IN_FLIGHT
+            ]
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False))
+            tmp_path.replace(self._path)
+        except OSError as e:
+            logger.warning(f"Could not save idempotency store: {str(e)}")
+
+
+idempotency_store = IdempotencyStore(
+    settings.idempotency_max_entries,
+    settings.idempotency_ttl,
+    settings.idempotency_store_path or None,
+)
+
+
+class IdempotentRequest:
+    """Per-request handle given to endpoints (no-op without Idempotency-Key)"""
+
+    def __init__(self, key: Optional[str], fingerprint: str = ""):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.replayed: Optional[JSONResponse] = None
+        self.written = False
+        self.completed = False
+
+    def mark_written(self) -> None:
+        """Call before the first write: from then on a failure keeps the key"""
+        self.written = True
+
+    def save(self, body: object, status_code: int = 200) -> object:
+        """Store the endpoint result for replays and return it unchanged"""
+        if self.key:
+            idempotency_store.complete(self.key, self.fingerprint, status_code, jsonable_encoder(body))
+            self.completed = True
+        return body
+
+
+async def get_idempotent_request(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    user: dict = Depends(verify_token),
+):
+    """
+    Dependency for write endpoints. When the key was already used, the
+    endpoint must return `idem.replayed` as is.
+    """
+    if not idempotency_key:
+        yield IdempotentRequest(None)
+        return
+
+    if len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key trop longue")
+
+    # Keys are scoped to the user and endpoint; the body must match on replay
+    key = f"{user['user_id']}:{request.method}:{request.url.path}:{idempotency_key}"
+    fingerprint = hashlib.sha256(await request.body()).hexdigest()
+    idem = IdempotentRequest(key, fingerprint)
+
+    stored = idempotency_store.begin(key, fingerprint)
+    if stored is not None:
+        status_code, body = stored
+        idem.replayed = JSONResponse(status_code=status_code, content=body, headers={"Idempotent-Replayed": "true"})
+        yield idem
+        return
+
+    try:
+        yield idem
+    finally:
+        if not idem.completed:
+            if idem.written:
+                idempotency_store.fail(key, fingerprint)
+            else:
+                idempotency_store.release(key)
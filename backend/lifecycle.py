@@ -0,0 +1,188 @@
+"""
+Startup warm-up and readiness state for Novlearn API
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+
+from fastapi import FastAPI
+from supabase import Client
+
+from config import settings, ENV_FILE, BOOT_TIME
+from auth import get_supabase_client
+
+logger = logging.getLogger(__name__)
+
+# Callables run during warm-up to fill in-process caches
+_preloaders: List[Callable[[Client], None]] = []
+
+# Callables run at startup, before warm-up (load local state)
+_startup_hooks: List[Callable[[], None]] = []
+
+# Callables run at shutdown (flush in-memory state)
+_shutdown_hooks: List[Callable[[], None]] = []
+
+# Background task retrying warm-up when it failed at startup
+_warmup_retry_task: Optional[asyncio.Task] = None
+
+# Worker-thread futures of the last warm-up / readiness probe. A timed out
+# call keeps running in its thread: the next attempt waits for it instead of
+# starting another one, so an outage cannot pile up worker threads.
+_warmup_future: Optional[asyncio.Future] = None
+_probe_future: Optional[asyncio.Future] = None
+
+_state = {
+    "warmed_up": False,
+    "warmup_ms": None,
+    "startup_ms": None,
+    "last_error": None,
+}
+
+
+def register_preloader(func: Callable[[Client], None]) -> Callable[[Client], None]:
+    """Register a cache preloader to run during warm-up (usable as decorator)"""
+    _preloaders.append(func)
+    return func
+
+
+def register_startup_hook(func: Callable[[], None]) -> Callable[[], None]:
+    """Register a callable to run when the application starts"""
+    _startup_hooks.append(func)
+    return func
+
+
+def register_shutdown_hook(func: Callable[[], None]) -> Callable[[], None]:
+    """Register a callable to run when the application stops"""
+    _shutdown_hooks.append(func)
+    return func
+
+
+def _log_configuration() -> None:
+    """Log Supabase configuration status (never the values themselves)"""
+    logger.info(f"SUPABASE_URL: {'SET' if settings.supabase_url else 'NOT SET'}")
+    logger.info(f"SUPABASE_SERVICE_KEY: {'SET' if settings.supabase_service_key else 'NOT SET'}")
+    if not settings.supabase_url or not settings.supabase_service_key:
+        logger.warning(f"Supabase credentials missing! Check {ENV_FILE}")
+
+
+def _probe_upstream(supabase: Client) -> None:
+    """Cheap round-trip to PostgREST, opens/reuses the pooled connection"""
+    supabase.table("exercises").select("id").limit(1).execute()
+
+
+def _warm_up_sync() -> None:
+    """
+    Build the Supabase client and open its pooled connections so the first
+    user request does not pay client construction and TLS handshakes.
+    """
+    supabase = get_supabase_client()
+    # PostgREST and Auth share one HTTP client: one probe opens the connection
+    _probe_upstream(supabase)
+
+    for preload in _preloaders:
+        preload(supabase)
+
+
+async def warm_up() -> bool:
+    """Run warm-up in a worker thread, bounded by settings.warmup_timeout"""
+    global _warmup_future
+
+    if _state["warmed_up"]:
+        return True
+
+    started = time.perf_counter()
+    if _warmup_future is None or _warmup_future.done():
+        _warmup_future = asyncio.ensure_future(asyncio.to_thread(_warm_up_sync))
+    try:
+        await asyncio.wait_for(asyncio.shield(_warmup_future), timeout=settings.warmup_timeout)
+        _state["warmed_up"] = True
+        _state["last_error"] = None
+    except asyncio.TimeoutError:
+        _state["last_error"] = f"Warm-up timed out after {settings.warmup_timeout}s"
+        logger.warning(_state["last_error"])
+    except Exception as e:
+        _state["last_error"] = str(e) or type(e).__name__
+        logger.warning(f"Warm-up failed: {_state['last_error']}")
+
+    _state["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return _state["warmed_up"]
+
+
+async def _retry_warm_up() -> None:
+    """Retry warm-up with exponential backoff until it succeeds"""
+    delay = settings.warmup_retry_interval
+    while True:
+        await asyncio.sleep(delay)
+        if await warm_up():
+            break
+        delay = min(delay * 2, settings.warmup_retry_max_interval)
+    logger.info("Warm-up succeeded after retry")
+
+
+async def check_readiness() -> dict:
+    """
+    Report whether the process can serve traffic: warm-up done (retried in
+    the background, never from here) and Supabase answering one probe
+    bounded by settings.ready_probe_timeout.
+    """
+    global _probe_future
+
+    upstream_ok = False
+    error = _state["last_error"]
+    if _state["warmed_up"]:
+        if _probe_future is None or _probe_future.done():
+            _probe_future = asyncio.ensure_future(asyncio.to_thread(_probe_upstream, get_supabase_client()))
+        try:
+            await asyncio.wait_for(asyncio.shield(_probe_future), timeout=settings.ready_probe_timeout)
+            upstream_ok = True
+            error = None
+        except asyncio.TimeoutError:
+            error = f"Supabase probe timed out after {settings.ready_probe_timeout}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+    return {
+        "ready": _state["warmed_up"] and upstream_ok,
+        "warmed_up": _state["warmed_up"],
+        "supabase": "reachable" if upstream_ok else "unreachable",
+        "warmup_ms": _state["warmup_ms"],
+        "startup_ms": _state["startup_ms"],
+        "startup_budget_ms": settings.startup_budget_ms,
+        "error": error,
+    }
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """FastAPI lifespan: run startup hooks and warm up before accepting requests, run shutdown hooks at exit"""
+    global _warmup_retry_task
+
+    _log_configuration()
+    for hook in _startup_hooks:
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"Startup hook {hook.__name__} failed: {str(e)}")
+    if not await warm_up():
+        _warmup_retry_task = asyncio.create_task(_retry_warm_up())
+
+    startup_ms = round((time.perf_counter() - BOOT_TIME) * 1000, 1)
+    _state["startup_ms"] = startup_ms
+    if startup_ms > settings.startup_budget_ms:
+        logger.warning(f"Startup took {startup_ms}ms (budget: {settings.startup_budget_ms}ms)")
+    else:
+        logger.info(f"Startup took {startup_ms}ms (budget: {settings.startup_budget_ms}ms)")
+
+    yield
+
+    if _warmup_retry_task is not None:
+        _warmup_retry_task.cancel()
+
+    for hook in _shutdown_hooks:
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"Shutdown hook {hook.__name__} failed: {str(e)}")
+
@@ -2,27 +2,39 @@
 API FastAPI pour Novlearn
 Backend principal de l'application avec système de duels et amis
 """
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
 from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from postgrest.exceptions import APIError
 import logging
 import random
+import time
 
 from config import settings
 from auth import verify_token, get_supabase_client
+from lifecycle import lifespan, check_readiness, register_preloader, register_startup_hook, register_shutdown_hook
+from exports import stream_duel_attempts, stream_duels, MEDIA_TYPES
+from profiles import profile_resolver
+from idempotency import IdempotentRequest, get_idempotent_request, idempotency_store
+from profiling import ProfilingMiddleware, profiling_enabled, verify_profiling_admin, list_profiles, get_profile_path
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# PostgreSQL foreign_key_violation (PostgREST APIError code)
+FOREIGN_KEY_VIOLATION = "23503"
+
 # Création de l'application FastAPI
 app = FastAPI(
     title="Novlearn API",
     description="API REST pour la plateforme Novlearn avec système de duels 1v1",
-    version="0.2.0"
+    version="0.2.0",
+    lifespan=lifespan
 )
 
 # Configuration CORS
@@ -32,8 +44,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the frontend to tell a request still running from a final 409
+    expose_headers=["Retry-After", "Idempotent-Replayed"],
 )
 
+# Persistance optionnelle des clés d'idempotence
+register_startup_hook(idempotency_store.load)
+register_shutdown_hook(idempotency_store.save)
+
+# Profilage opt-in (header admin, échantillonnage ou seuil de latence)
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
 # ============================================
 # MODELS
 # ============================================
@@ -64,6 +86,17 @@ class SubmitDuelAnswerRequest(BaseModel):
     time_spent: int  # millisecondes
 
 
+class DuelElementAnswer(BaseModel):
+    element_id: int
+    answer: str
+    is_correct: bool
+    time_spent: int  # millisecondes
+
+
+class SubmitDuelAnswersBatchRequest(BaseModel):
+    answers: List[DuelElementAnswer] = Field(..., min_length=1, max_length=100)
+
+
 # ============================================
 # HEALTH CHECK
 # ============================================
@@ -102,6 +135,25 @@ async def api_health_check():
     )
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: warm-up terminé et Supabase joignable.
+    Retourne 503 tant que le processus ne peut pas servir de requêtes.
+    """
+    readiness = await check_readiness()
+    return JSONResponse(
+        status_code=200 if readiness["ready"] else 503,
+        content={"service": "Novlearn API", **readiness}
+    )
+
+
+@app.get("/api/ready")
+async def api_readiness_check():
+    """Readiness probe (alias)"""
+    return await readiness_check()
+
+
 # ============================================
 # FRIENDS ENDPOINTS
 # ============================================
@@ -205,46 +257,20 @@ async def get_friends(user: dict = Depends(verify_token)):
         supabase = get_supabase_client()
         user_id = user["user_id"]
         
-        # Get friendships where user is either user1 or user2
+        # Friend ids only; names come from the shared profile cache
+        friend_ids = get_friend_ids(supabase, user_id)
+        profiles = profile_resolver.resolve(supabase, friend_ids)
+
         friends_data = []
-        
-        # Query as user1
-        result1 = supabase.table("friends")\
-            .select("*, user2:user2_id(id, email, profiles(first_name, last_name))")\
-            .eq("user1_id", user_id)\
-            .eq("status", "accepted")\
-            .execute()
-        
-        for friend in result1.data or []:
-            if friend.get("user2"):
-                user_data = friend["user2"]
-                profile = user_data.get("profiles", [{}])[0] if user_data.get("profiles") else {}
-                friends_data.append({
-                    "id": user_data.get("id"),
-                    "email": user_data.get("email"),
-                    "first_name": profile.get("first_name", ""),
-                    "last_name": profile.get("last_name", ""),
-                    "name": f"{profile.get('first_name', '')} {profile.get('last_name', '')}".strip() or user_data.get("email", "").split("@")[0]
-                })
-        
-        # Query as user2
-        result2 = supabase.table("friends")\
-            .select("*, user1:user1_id(id, email, profiles(first_name, last_name))")\
-            .eq("user2_id", user_id)\
-            .eq("status", "accepted")\
-            .execute()
-        
-        for friend in result2.data or []:
-            if friend.get("user1"):
-                user_data = friend["user1"]
-                profile = user_data.get("profiles", [{}])[0] if user_data.get("profiles") else {}
-                friends_data.append({
-                    "id": user_data.get("id"),
-                    "email": user_data.get("email"),
-                    "first_name": profile.get("first_name", ""),
-                    "last_name": profile.get("last_name", ""),
-                    "name": f"{profile.get('first_name', '')} {profile.get('last_name', '')}".strip() or user_data.get("email", "").split("@")[0]
-                })
+        for friend_id in friend_ids:
+            profile = profiles[friend_id]
+            friends_data.append({
+                "id": friend_id,
+                "email": profile.email,
+                "first_name": profile.first_name,
+                "last_name": profile.last_name,
+                "name": profile.name
+            })
         
         return {"friends": friends_data}
     
@@ -262,22 +288,22 @@ async def get_friend_requests(user: dict = Depends(verify_token)):
         
         # Get requests where user is the recipient
         result = supabase.table("friend_requests")\
-            .select("*, from_user:from_user_id(id, email, profiles(first_name, last_name))")\
+            .select("id, from_user_id, created_at")\
             .eq("to_user_id", user_id)\
             .eq("status", "pending")\
             .execute()
         
+        rows = result.data or []
+        profiles = profile_resolver.resolve(supabase, (req["from_user_id"] for req in rows))
+        
         requests_data = []
-        for req in result.data or []:
-            if req.get("from_user"):
-                user_data = req["from_user"]
-                profile = user_data.get("profiles", [{}])[0] if user_data.get("profiles") else {}
-                requests_data.append({
-                    "id": req.get("id"),
-                    "from_user_id": user_data.get("id"),
-                    "from_user_name": f"{profile.get('first_name', '')} {profile.get('last_name', '')}".strip() or user_data.get("email", "").split("@")[0],
-                    "created_at": req.get("created_at")
-                })
+        for req in rows:
+            requests_data.append({
+                "id": req.get("id"),
+                "from_user_id": req["from_user_id"],
+                "from_user_name": profiles[req["from_user_id"]].name,
+                "created_at": req.get("created_at")
+            })
         
         return {"requests": requests_data}
     
@@ -337,13 +363,31 @@ async def decline_friend_request(request_id: int, user: dict = Depends(verify_to
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ============================================
+# PROFILES ENDPOINTS
+# ============================================
+
+@app.post("/api/profiles/me/refresh")
+async def refresh_my_profile(user: dict = Depends(verify_token)):
+    """Invalidate the cached display name after a profile update"""
+    profile_resolver.invalidate(user["user_id"])
+    return {"message": "Profil rafraîchi"}
+
+
 # ============================================
 # DUELS ENDPOINTS
 # ============================================
 
 @app.post("/api/duels/create")
-async def create_duel(request: CreateDuelRequest, user: dict = Depends(verify_token)):
-    """Create a duel challenge"""
+async def create_duel(
+    request: CreateDuelRequest,
+    user: dict = Depends(verify_token),
+    idem: IdempotentRequest = Depends(get_idempotent_request)
+):
+    """Create a duel challenge (supports Idempotency-Key)"""
+    if idem.replayed:
+        return idem.replayed
+    
     try:
         supabase = get_supabase_client()
         user_id = user["user_id"]
@@ -365,11 +409,8 @@ async def create_duel(request: CreateDuelRequest, user: dict = Depends(verify_to
         # Get default exercise if none specified
         exercise_id = request.exercise_id
         if not exercise_id:
-            # Get first available exercise
-            exercises = supabase.table("exercises").select("id").limit(1).execute()
-            if exercises.data:
-                exercise_id = exercises.data[0]["id"]
-            else:
+            exercise_id = get_default_exercise_id(supabase)
+            if not exercise_id:
                 raise HTTPException(status_code=404, detail="Aucun exercice disponible")
         
         # Create duel
@@ -382,12 +423,25 @@ async def create_duel(request: CreateDuelRequest, user: dict = Depends(verify_to
             "player2_score": 0
         }
         
-        result = supabase.table("duels").insert(duel_data).execute()
+        idem.mark_written()
+        try:
+            result = supabase.table("duels").insert(duel_data).execute()
+        except APIError as e:
+            # Only a rejected insert is safe to retry: after a timeout or a
+            # dropped connection the first duel may already exist
+            if request.exercise_id or e.code != FOREIGN_KEY_VIOLATION:
+                raise
+            # The cached default exercise was deleted: reload it and retry once
+            reloaded_id = get_default_exercise_id(supabase, refresh=True)
+            if not reloaded_id or reloaded_id == exercise_id:
+                raise
+            duel_data["exercise_id"] = reloaded_id
+            result = supabase.table("duels").insert(duel_data).execute()
         
         if not result.data:
             raise HTTPException(status_code=500, detail="Erreur lors de la création du duel")
         
-        return {"message": "Duel créé avec succès", "duel_id": result.data[0]["id"], "duel": result.data[0]}
+        return idem.save({"message": "Duel créé avec succès", "duel_id": result.data[0]["id"], "duel": result.data[0]})
     
     except HTTPException:
         raise
@@ -488,23 +542,23 @@ async def get_pending_duels(user: dict = Depends(verify_token)):
         
         # Get duels where user is player2 and status is waiting
         result = supabase.table("duels")\
-            .select("*, player1:player1_id(id, email, profiles(first_name, last_name)), exercise:exercise_id(title)")\
+            .select("id, player1_id, created_at, exercise:exercise_id(title)")\
             .eq("player2_id", user_id)\
             .eq("status", "waiting")\
             .execute()
         
+        rows = result.data or []
+        profiles = profile_resolver.resolve(supabase, (duel["player1_id"] for duel in rows))
+        
         duels_data = []
-        for duel in result.data or []:
-            if duel.get("player1"):
-                user_data = duel["player1"]
-                profile = user_data.get("profiles", [{}])[0] if user_data.get("profiles") else {}
-                duels_data.append({
-                    "id": duel.get("id"),
-                    "from_user_id": user_data.get("id"),
-                    "from_user_name": f"{profile.get('first_name', '')} {profile.get('last_name', '')}".strip() or user_data.get("email", "").split("@")[0],
-                    "exercise_title": duel.get("exercise", {}).get("title", "Exercice"),
-                    "created_at": duel.get("created_at")
-                })
+        for duel in rows:
+            duels_data.append({
+                "id": duel.get("id"),
+                "from_user_id": duel["player1_id"],
+                "from_user_name": profiles[duel["player1_id"]].name,
+                "exercise_title": (duel.get("exercise") or {}).get("title", "Exercice"),
+                "created_at": duel.get("created_at")
+            })
         
         return {"duels": duels_data}
     
@@ -542,7 +596,7 @@ async def get_duel(duel_id: int, user: dict = Depends(verify_token)):
         user_id = user["user_id"]
         
         result = supabase.table("duels")\
-            .select("*, exercise:exercise_id(id, title, chapter, difficulty, content), player1:player1_id(id, email, profiles(first_name, last_name)), player2:player2_id(id, email, profiles(first_name, last_name))")\
+            .select("*, exercise:exercise_id(id, title, chapter, difficulty, content)")\
             .eq("id", duel_id)\
             .execute()
         
@@ -555,6 +609,10 @@ async def get_duel(duel_id: int, user: dict = Depends(verify_token)):
         if duel["player1_id"] != user_id and duel["player2_id"] != user_id:
             raise HTTPException(status_code=403, detail="Vous n'êtes pas autorisé à voir ce duel")
         
+        profiles = profile_resolver.resolve(supabase, (duel["player1_id"], duel["player2_id"]))
+        duel["player1"] = profiles[duel["player1_id"]].as_user()
+        duel["player2"] = profiles[duel["player2_id"]].as_user() if duel["player2_id"] else None
+        
         return {"duel": duel}
     
     except HTTPException:
@@ -565,8 +623,16 @@ async def get_duel(duel_id: int, user: dict = Depends(verify_token)):
 
 
 @app.post("/api/duels/{duel_id}/submit")
-async def submit_duel_answer(duel_id: int, request: SubmitDuelAnswerRequest, user: dict = Depends(verify_token)):
-    """Submit answer in a duel"""
+async def submit_duel_answer(
+    duel_id: int,
+    request: SubmitDuelAnswerRequest,
+    user: dict = Depends(verify_token),
+    idem: IdempotentRequest = Depends(get_idempotent_request)
+):
+    """Submit answer in a duel (supports Idempotency-Key)"""
+    if idem.replayed:
+        return idem.replayed
+    
     try:
         supabase = get_supabase_client()
         user_id = user["user_id"]
@@ -593,6 +659,7 @@ async def submit_duel_answer(duel_id: int, request: SubmitDuelAnswerRequest, use
             "time_spent": request.time_spent
         }
         
+        idem.mark_written()
         supabase.table("duel_attempts").insert(attempt_data).execute()
         
         # Update score if correct
@@ -613,14 +680,14 @@ async def submit_duel_answer(duel_id: int, request: SubmitDuelAnswerRequest, use
             # Get updated duel
             updated_duel = supabase.table("duels").select("*").eq("id", duel_id).execute()
             
-            return {
+            return idem.save({
                 "message": "Réponse enregistrée",
                 "correct": True,
                 "new_score": new_score,
                 "duel": updated_duel.data[0] if updated_duel.data else duel_data
-            }
+            })
         
-        return {"message": "Réponse enregistrée", "correct": False}
+        return idem.save({"message": "Réponse enregistrée", "correct": False})
     
     except HTTPException:
         raise
@@ -629,10 +696,271 @@ async def submit_duel_answer(duel_id: int, request: SubmitDuelAnswerRequest, use
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/duels/{duel_id}/submit-batch")
+async def submit_duel_answers_batch(
+    duel_id: int,
+    request: SubmitDuelAnswersBatchRequest,
+    user: dict = Depends(verify_token),
+    idem: IdempotentRequest = Depends(get_idempotent_request)
+):
+    """Submit answers for several elements of a duel in one request (supports Idempotency-Key)"""
+    if idem.replayed:
+        return idem.replayed
+    
+    try:
+        supabase = get_supabase_client()
+        user_id = user["user_id"]
+        
+        # Get duel (once for the whole batch)
+        duel = supabase.table("duels").select("*").eq("id", duel_id).execute()
+        
+        if not duel.data:
+            raise HTTPException(status_code=404, detail="Duel introuvable")
+        
+        duel_data = duel.data[0]
+        
+        # Check if user is part of the duel
+        if duel_data["player1_id"] != user_id and duel_data["player2_id"] != user_id:
+            raise HTTPException(status_code=403, detail="Vous n'êtes pas autorisé à soumettre une réponse pour ce duel")
+        
+        # Record all attempts with a single bulk insert
+        idem.mark_written()
+        supabase.table("duel_attempts").insert([
+            {
+                "duel_id": duel_id,
+                "player_id": user_id,
+                "element_id": answer.element_id,
+                "answer": answer.answer,
+                "is_correct": answer.is_correct,
+                "time_spent": answer.time_spent
+            }
+            for answer in request.answers
+        ]).execute()
+        
+        results = [{"element_id": answer.element_id, "correct": answer.is_correct} for answer in request.answers]
+        correct_answers = [answer for answer in request.answers if answer.is_correct]
+        
+        if not correct_answers:
+            return idem.save({"message": "Réponses enregistrées", "results": results, "correct_count": 0, "duel": duel_data})
+        
+        # One aggregated score/time update (time counts for correct answers only, as in /submit)
+        is_player1 = duel_data["player1_id"] == user_id
+        score_field = "player1_score" if is_player1 else "player2_score"
+        time_field = "player1_time" if is_player1 else "player2_time"
+        
+        new_score = (duel_data[score_field] or 0) + len(correct_answers)
+        new_time = (duel_data[time_field] or 0) + sum(answer.time_spent for answer in correct_answers)
+        
+        # The update returns the updated row: no re-read needed
+        updated_duel = supabase.table("duels").update({
+            score_field: new_score,
+            time_field: new_time
+        }).eq("id", duel_id).execute()
+        
+        return idem.save({
+            "message": "Réponses enregistrées",
+            "results": results,
+            "correct_count": len(correct_answers),
+            "new_score": new_score,
+            "duel": updated_duel.data[0] if updated_duel.data else duel_data
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error submitting answers batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============================================
+# EXPORT ENDPOINTS
+# ============================================
+
+def _resolve_class_users(supabase, user_id: str, user_ids: Optional[str]) -> List[str]:
+    """
+    Users whose history can be exported or analysed: the caller and their accepted friends
+    (the "class" shown on the Classes page). Optionally narrowed by user_ids.
+    """
+    allowed = {user_id, *get_friend_ids(supabase, user_id)}
+    if not user_ids:
+        return sorted(allowed)
+
+    requested = {uid.strip() for uid in user_ids.split(",") if uid.strip()}
+    forbidden = requested - allowed
+    if forbidden:
+        raise HTTPException(status_code=403, detail="Vous ne pouvez consulter que vos données et celles de vos amis")
+    return sorted(requested)
+
+
+def _export_response(chunks, fmt: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'}
+    )
+
+
+@app.get("/api/exports/duel-attempts")
+async def export_duel_attempts(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_ids: Optional[str] = Query(None, description="Comma-separated user ids (default: you and your friends)"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    exercise_id: Optional[int] = None,
+    after_id: int = Query(0, ge=0, description="Resume after this attempt id"),
+    user: dict = Depends(verify_token)
+):
+    """Stream duel attempts history as NDJSON or CSV"""
+    try:
+        supabase = get_supabase_client()
+        players = _resolve_class_users(supabase, user["user_id"], user_ids)
+
+        chunks = stream_duel_attempts(
+            supabase,
+            players,
+            fmt=format,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=date_to.isoformat() if date_to else None,
+            exercise_id=exercise_id,
+            after_id=after_id
+        )
+        return _export_response(chunks, format, "duel_attempts")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting duel attempts: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/exports/duels")
+async def export_duels(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_ids: Optional[str] = Query(None, description="Comma-separated user ids (default: you and your friends)"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    exercise_id: Optional[int] = None,
+    after_id: int = Query(0, ge=0, description="Resume after this duel id"),
+    user: dict = Depends(verify_token)
+):
+    """Stream duels and their results as NDJSON or CSV"""
+    try:
+        supabase = get_supabase_client()
+        players = _resolve_class_users(supabase, user["user_id"], user_ids)
+
+        chunks = stream_duels(
+            supabase,
+            players,
+            fmt=format,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=date_to.isoformat() if date_to else None,
+            exercise_id=exercise_id,
+            after_id=after_id
+        )
+        return _export_response(chunks, format, "duels")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting duels: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============================================
+# ANALYTICS ENDPOINTS
+# ============================================
+
+def _class_analytics(supabase, players: List[str], exercise_id: Optional[int]) -> dict:
+    # Imported on first use: NumPy adds ~70ms to startup for one endpoint
+    from analytics import analytics_cache, compute_class_analytics
+
+    columns = analytics_cache.get_columns(supabase, players)
+    return compute_class_analytics(columns, exercise_id)
+
+
+@app.get("/api/analytics/class")
+async def get_class_analytics(
+    user_ids: Optional[str] = Query(None, description="Comma-separated user ids (default: you and your friends)"),
+    exercise_id: Optional[int] = None,
+    user: dict = Depends(verify_token)
+):
+    """Per-exercise and per-element difficulty: correctness rate, time percentiles, outliers"""
+    try:
+        supabase = get_supabase_client()
+        players = _resolve_class_users(supabase, user["user_id"], user_ids)
+
+        # Loading and NumPy work can take a while at class scale: keep it off the event loop
+        analytics = await run_in_threadpool(_class_analytics, supabase, players, exercise_id)
+        return {"players": len(players), **analytics}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error computing class analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============================================
+# ADMIN ENDPOINTS
+# ============================================
+
+@app.get("/api/admin/profiles", dependencies=[Depends(verify_profiling_admin)])
+async def get_recent_profiles(limit: int = Query(50, ge=1, le=500)):
+    """List recent profiled / slow requests, newest first"""
+    return {"profiles": list_profiles(limit)}
+
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(verify_profiling_admin)])
+async def download_profile(profile_id: str):
+    """Download a captured profile (pstats format)"""
+    path = get_profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profil introuvable")
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
+def get_friend_ids(supabase, user_id: str) -> List[str]:
+    """Get ids of accepted friends for a user"""
+    result1 = supabase.table("friends")\
+        .select("user2_id")\
+        .eq("user1_id", user_id)\
+        .eq("status", "accepted")\
+        .execute()
+    result2 = supabase.table("friends")\
+        .select("user1_id")\
+        .eq("user2_id", user_id)\
+        .eq("status", "accepted")\
+        .execute()
+
+    return [row["user2_id"] for row in result1.data or []] + [row["user1_id"] for row in result2.data or []]
+
+
+# Default exercise for duels, preloaded at startup and reloaded after DEFAULT_EXERCISE_TTL
+_default_exercise_id: Optional[int] = None
+_default_exercise_loaded_at: float = 0.0
+
+
+@register_preloader
+def load_default_exercise_id(supabase) -> None:
+    """Cache the first available exercise id (used when a duel has none)"""
+    global _default_exercise_id, _default_exercise_loaded_at
+    exercises = supabase.table("exercises").select("id").order("id").limit(1).execute()
+    _default_exercise_id = exercises.data[0]["id"] if exercises.data else None
+    _default_exercise_loaded_at = time.monotonic()
+
+
+def get_default_exercise_id(supabase, refresh: bool = False) -> Optional[int]:
+    """Get the default exercise id, reloading it when missing, expired or on refresh"""
+    expired = time.monotonic() - _default_exercise_loaded_at > settings.default_exercise_ttl
+    if refresh or expired or _default_exercise_id is None:
+        load_default_exercise_id(supabase)
+    return _default_exercise_id
+
+
 def generate_unique_code(length: int = 8) -> str:
     """Generate a random alphanumeric code"""
     import string
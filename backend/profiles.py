@@ -0,0 +1,98 @@
+"""
+Display-name resolution for Novlearn API
+
+Endpoints select only user ids and resolve names here: profiles are held in
+a bounded LRU cache of compact records, and missing ones are fetched with a
+single `id=in.(...)` query per call.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+from supabase import Client
+
+from config import settings
+
+
+class ProfileRecord:
+    """Compact cached profile (no per-instance __dict__)"""
+    __slots__ = ("id", "email", "first_name", "last_name", "loaded_at")
+
+    def __init__(self, id: str, email: str = "", first_name: str = "", last_name: str = ""):
+        self.id = id
+        self.email = email or ""
+        self.first_name = first_name or ""
+        self.last_name = last_name or ""
+        self.loaded_at = time.monotonic()
+
+    @property
+    def name(self) -> str:
+        """Full name, falling back to the local part of the email"""
+        return f"{self.first_name} {self.last_name}".strip() or self.email.split("@")[0]
+
+    def as_user(self) -> dict:
+        """Same shape as the former `user:user_id(id, email, profiles(...))` embed"""
+        return {
+            "id": self.id,
+            "email": self.email,
+            "name": self.name,
+            "profiles": [{"first_name": self.first_name, "last_name": self.last_name}],
+        }
+
+
+class ProfileResolver:
+    """LRU cache of ProfileRecord with TTL and explicit invalidation"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._records: "OrderedDict[str, ProfileRecord]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, supabase: Client, user_ids: Iterable[str]) -> Dict[str, ProfileRecord]:
+        """Get records for user_ids, fetching cache misses in one query"""
+        wanted = {uid for uid in user_ids if uid}
+        found: Dict[str, ProfileRecord] = {}
+        now = time.monotonic()
+
+        with self._lock:
+            for uid in wanted:
+                record = self._records.get(uid)
+                if record is not None and now - record.loaded_at < self._ttl:
+                    self._records.move_to_end(uid)
+                    found[uid] = record
+
+        missing = sorted(wanted - found.keys())
+        if missing:
+            result = supabase.table("profiles")\
+                .select("id, email, first_name, last_name")\
+                .in_("id", missing)\
+                .execute()
+
+            fetched = {row["id"]: row for row in result.data or []}
+            for uid in missing:
+                row = fetched.get(uid, {})
+                # Users without a profile row are cached too, to avoid refetching
+                found[uid] = ProfileRecord(uid, row.get("email"), row.get("first_name"), row.get("last_name"))
+
+            with self._lock:
+                for uid in missing:
+                    self._records[uid] = found[uid]
+                    self._records.move_to_end(uid)
+                while len(self._records) > self._max_size:
+                    self._records.popitem(last=False)
+
+        return found
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a cached profile (after it was updated)"""
+        with self._lock:
+            self._records.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+
+profile_resolver = ProfileResolver(settings.profile_cache_size, settings.profile_cache_ttl)
@@ -0,0 +1,245 @@
+"""
+Opt-in per-request profiling for Novlearn API
+
+Triggers:
+- admin header: `X-Profile-Token` matches PROFILING_ADMIN_TOKEN -> cProfile
+- sampling: a random fraction PROFILING_SAMPLE_RATE of requests -> cProfile
+- latency: with PROFILING_SLOW_MS > 0, every request gets a cheap record
+  (wall time + upstream call timings) kept only when slower than the
+  threshold; no cProfile overhead, and overlapping requests are all recorded
+
+Each capture is written to PROFILING_DIR as a `.json` summary (wall time,
+time spent waiting on each upstream Supabase call) plus, for cProfile
+captures, a pstats file (`.prof`, readable with `python -m pstats` or
+snakeviz). The directory is a ring: only the newest PROFILING_MAX_FILES are
+kept.
+
+Timings end when the response body has been sent, so streamed responses
+(exports) include their page queries. cProfile only covers the handler up to
+the response headers: streamed bodies are produced in worker threads. It
+runs on the event-loop thread, so it also sees other requests running at the
+same time: the summary records how many overlapped (`concurrent_requests`),
+and `process_cpu_ms` is CPU time of the whole process, not of the request
+alone.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import secrets
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+from fastapi import HTTPException, Header, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Token"
+
+# Upstream calls of the current request (None when the request is not recorded)
+_upstream_calls: ContextVar[Optional[List[dict]]] = ContextVar("upstream_calls", default=None)
+
+# cProfile can only profile one request at a time per thread
+_profiler_busy = False
+
+# Requests currently going through the middleware, and the peak seen during
+# the running cProfile capture
+_active_requests = 0
+_peak_during_profile = 0
+
+# Last capture timestamp handed out, so ids strictly increase in this process
+_last_capture_ns = 0
+
+
+class TimedTransport(httpx.BaseTransport):
+    """HTTP transport recording the duration of each upstream call"""
+
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        calls = _upstream_calls.get()
+        if calls is None:
+            return self._transport.handle_request(request)
+
+        started = time.perf_counter()
+        response = self._transport.handle_request(request)
+        # Supabase responses are small JSON bodies: read them here so the
+        # measured time includes the download, not only the headers
+        response.read()
+        calls.append({
+            "method": request.method,
+            "url": str(request.url),
+            "status": response.status_code,
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+        return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def profiling_enabled() -> bool:
+    """True when at least one profiling trigger is configured"""
+    return bool(settings.profiling_admin_token or settings.profiling_sample_rate > 0 or settings.profiling_slow_ms > 0)
+
+
+def is_profiling_admin(token: Optional[str]) -> bool:
+    """Check the admin profiling token (constant-time comparison)"""
+    return bool(settings.profiling_admin_token and token) and secrets.compare_digest(token, settings.profiling_admin_token)
+
+
+async def verify_profiling_admin(x_profile_token: str = Header(None)) -> None:
+    """Dependency restricting profile listing to holders of the admin token"""
+    if not is_profiling_admin(x_profile_token):
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+
+
+def _profile_dir() -> Path:
+    return Path(settings.profiling_dir)
+
+
+def _write_profile(profiler: Optional[cProfile.Profile], summary: dict) -> None:
+    """Write summary (+ profile), then drop the oldest files beyond the ring size
+    (ids start with a fixed-width nanosecond timestamp, so name order is
+    capture order)"""
+    directory = _profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+
+    if profiler is not None:
+        profiler.dump_stats(str(directory / f"{summary['id']}.prof"))
+    (directory / f"{summary['id']}.json").write_text(json.dumps(summary, ensure_ascii=False))
+
+    summaries = sorted(directory.glob("*.json"), reverse=True)
+    for old in summaries[settings.profiling_max_files:]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def list_profiles(limit: int = 50) -> List[dict]:
+    """Summaries of the most recent captured profiles, newest first"""
+    directory = _profile_dir()
+    if not directory.exists():
+        return []
+
+    summaries = sorted(directory.glob("*.json"), reverse=True)
+    profiles = []
+    for path in summaries[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return profiles
+
+
+def get_profile_path(profile_id: str) -> Optional[Path]:
+    """Path of a stored pstats file, None if unknown (ids are generated, no paths)"""
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    path = _profile_dir() / f"{profile_id}.prof"
+    return path if path.exists() else None
+
+
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    """Profile or time selected requests and store them in the ring directory"""
+
+    async def dispatch(self, request: Request, call_next):
+        global _active_requests, _peak_during_profile
+
+        _active_requests += 1
+        _peak_during_profile = max(_peak_during_profile, _active_requests)
+        try:
+            return await self._dispatch(request, call_next)
+        finally:
+            _active_requests -= 1
+
+    async def _dispatch(self, request: Request, call_next):
+        global _profiler_busy, _peak_during_profile
+
+        if is_profiling_admin(request.headers.get(PROFILE_HEADER)):
+            trigger = "header"
+        elif settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate:
+            trigger = "sample"
+        elif settings.profiling_slow_ms > 0:
+            trigger = "slow"
+        else:
+            return await call_next(request)
+
+        # Only one cProfile capture at a time; others fall back to timing
+        profiler = None
+        if trigger != "slow" and not _profiler_busy:
+            _profiler_busy = True
+            _peak_during_profile = _active_requests
+            profiler = cProfile.Profile()
+        elif trigger != "slow" and settings.profiling_slow_ms <= 0:
+            return await call_next(request)
+
+        # The app runs in a task created by call_next, which keeps this list
+        # in its context while the body streams, after the reset below
+        calls: List[dict] = []
+        token = _upstream_calls.set(calls)
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profiler_busy = False
+            _upstream_calls.reset(token)
+
+        async def timed_body():
+            try:
+                async for chunk in body_iterator:
+                    yield chunk
+            finally:
+                await self._finish(request, response, trigger, profiler, calls, wall_started, cpu_started)
+
+        body_iterator = response.body_iterator
+        response.body_iterator = timed_body()
+        return response
+
+    async def _finish(self, request, response, trigger, profiler, calls, wall_started, cpu_started) -> None:
+        """Store the capture once the body has been sent (or the stream aborted)"""
+        global _last_capture_ns
+
+        wall_ms = (time.perf_counter() - wall_started) * 1000
+        process_cpu_ms = (time.process_time() - cpu_started) * 1000
+        if profiler is None and wall_ms < settings.profiling_slow_ms:
+            return
+        if profiler is None:
+            trigger = "slow"
+
+        _last_capture_ns = max(time.time_ns(), _last_capture_ns + 1)
+        summary = {
+            "id": f"{_last_capture_ns:020d}-{uuid.uuid4().hex[:8]}",
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "trigger": trigger,
+            "has_profile": profiler is not None,
+            "wall_ms": round(wall_ms, 2),
+            "upstream_ms": round(sum(call["ms"] for call in calls), 2),
+            "upstream_calls": list(calls),
+            "pid": os.getpid(),
+            "captured_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        if profiler is not None:
+            summary["process_cpu_ms"] = round(process_cpu_ms, 2)
+            summary["concurrent_requests"] = _peak_during_profile
+        try:
+            await run_in_threadpool(_write_profile, profiler, summary)
+            logger.info(f"Captured {request.method} {request.url.path} ({trigger}): {summary['wall_ms']}ms")
+        except Exception as e:
+            logger.error(f"Could not write profile: {str(e)}")
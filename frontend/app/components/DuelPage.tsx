@@ -1,9 +1,9 @@
 'use client';
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Users, Swords } from "lucide-react";
 import { useRouter } from "next/navigation";
-import { friendsApi, duelsApi, Friend, DuelRequest as ApiDuelRequest } from "../lib/api";
+import { friendsApi, duelsApi, isOutcomeUnknown, Friend, DuelRequest as ApiDuelRequest } from "../lib/api";
 
 interface LocalDuelRequest {
   id: string;
@@ -17,6 +17,9 @@ export function DuelPage() {
   const [duelRequests, setDuelRequests] = useState<LocalDuelRequest[]>([]);
   const [sentDuels, setSentDuels] = useState<string[]>([]);
   const [loading, setLoading] = useState(true);
+  // Idempotency-Key per friend while a duel request is unresolved: a double
+  // tap or a retry after a timeout reuses it and cannot create two duels
+  const duelRequestKeys = useRef<Record<string, string>>({});
 
   useEffect(() => {
     loadData();
@@ -46,11 +49,18 @@ export function DuelPage() {
   const handleSendDuelRequest = async (friendId: string, friendName: string) => {
     if (sentDuels.includes(friendId)) return;
     
+    const idempotencyKey = duelRequestKeys.current[friendId] ?? crypto.randomUUID();
+    duelRequestKeys.current[friendId] = idempotencyKey;
+    
     try {
-      await duelsApi.createDuel(friendId);
-      setSentDuels([...sentDuels, friendId]);
+      await duelsApi.createDuel(friendId, idempotencyKey);
+      delete duelRequestKeys.current[friendId];
+      setSentDuels((sent) => (sent.includes(friendId) ? sent : [...sent, friendId]));
       alert(`Demande de duel envoyée à ${friendName} !`);
     } catch (error: any) {
+      if (!isOutcomeUnknown(error)) {
+        delete duelRequestKeys.current[friendId];
+      }
       console.error("Error sending duel:", error);
       alert(error.message || "Erreur lors de l'envoi de la demande");
     }
@@ -3,6 +3,7 @@
 import { createContext, useContext, useEffect, useState, ReactNode } from 'react';
 import { User, Session } from '@supabase/supabase-js';
 import { supabase } from '../lib/supabase';
+import { profilesApi } from '../lib/api';
 
 interface Profile {
   id: string;
@@ -139,6 +140,8 @@ export function AuthProvider({ children }: { children: ReactNode }) {
           last_name: lastName || fullName.split(' ').slice(1).join(' ') || null,
         })
         .eq('id', user.id);
+      // Le backend met les noms en cache : on invalide l'entrée
+      profilesApi.refreshProfile().catch(() => {});
     }
   };
 
@@ -2,11 +2,11 @@
 
 import { Trophy, Zap } from "lucide-react";
 import { useParams, useRouter } from "next/navigation";
-import { useCallback, useEffect, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import { Layout } from "../../../components/Layout";
 import MathText from "../../../components/ui/MathText";
 import { useAuth } from "../../../contexts/AuthContext";
-import { Duel, duelsApi } from "../../../lib/api";
+import { Duel, duelsApi, isOutcomeUnknown } from "../../../lib/api";
 import { supabase } from "../../../lib/supabase";
 import QuestionRenderer from "../../../renderers/QuestionRenderer";
 import { Exercise, TextContent, VariableValues } from "../../../types/exercise";
@@ -22,6 +22,14 @@ export default function ActiveDuelPage() {
   const [variables, setVariables] = useState<VariableValues>({});
   const [loading, setLoading] = useState(true);
   const [startTime] = useState(Date.now());
+  // Submission still unresolved: submitting the same answer again reuses its
+  // Idempotency-Key and body (time included), so it is recorded only once
+  const pendingSubmission = useRef<{
+    answer: string;
+    isCorrect: boolean;
+    timeSpent: number;
+    idempotencyKey: string;
+  } | null>(null);
 
   // Load duel data
   useEffect(() => {
@@ -97,7 +105,12 @@ export default function ActiveDuelPage() {
     async (answer: string, isCorrect: boolean) => {
       if (!exercise || !duel) return;
 
-      const timeSpent = Date.now() - startTime;
+      const pending = pendingSubmission.current;
+      const submission =
+        pending && pending.answer === answer && pending.isCorrect === isCorrect
+          ? pending
+          : { answer, isCorrect, timeSpent: Date.now() - startTime, idempotencyKey: crypto.randomUUID() };
+      pendingSubmission.current = submission;
 
       try {
         const result = await duelsApi.submitAnswer(
@@ -105,8 +118,12 @@ export default function ActiveDuelPage() {
           exercise.elements[0].id, // Pour l'instant, on utilise le premier élément
           answer,
           isCorrect,
-          timeSpent
+          submission.timeSpent,
+          submission.idempotencyKey
         );
+        if (pendingSubmission.current === submission) {
+          pendingSubmission.current = null;
+        }
 
         if (result.duel) {
           setDuel(result.duel);
@@ -117,6 +134,9 @@ export default function ActiveDuelPage() {
           await loadDuel();
         }
       } catch (error: any) {
+        if (!isOutcomeUnknown(error) && pendingSubmission.current === submission) {
+          pendingSubmission.current = null;
+        }
         console.error("Error submitting answer:", error);
         alert(error.message || "Erreur lors de la soumission de la réponse");
       }
@@ -18,12 +18,12 @@ async function getAuthHeaders(): Promise<HeadersInit> {
     
     if (error) {
       console.error('[api.ts] Session error:', error.message);
-      throw new Error('Not authenticated');
+      throw Object.assign(new Error('Not authenticated'), { status: 401 });
     }
     
     if (!session?.access_token) {
       console.error('[api.ts] No session or access token');
-      throw new Error('Not authenticated');
+      throw Object.assign(new Error('Not authenticated'), { status: 401 });
     }
     
     return {
@@ -74,7 +74,10 @@ async function apiRequest<T>(
     if (!response.ok) {
       const error = await response.json().catch(() => ({ detail: 'Unknown error' }));
       console.error(`[api.ts] ${endpoint} error:`, error);
-      throw new Error(error.detail || `HTTP ${response.status}`);
+      throw Object.assign(new Error(error.detail || `HTTP ${response.status}`), {
+        status: response.status,
+        retryAfter: response.headers.get('Retry-After'),
+      });
     }
     
     return response.json();
@@ -91,6 +94,48 @@ async function apiRequest<T>(
   }
 }
 
+/**
+ * Whether a failed write may still have been applied (timeout, network
+ * error, 5xx, or the same request still running). The caller then keeps the
+ * action's Idempotency-Key, so trying the action again is replayed by the
+ * backend instead of being run twice.
+ */
+export function isOutcomeUnknown(error: any): boolean {
+  const status: number | undefined = error?.status;
+  return status === undefined || status >= 500 || (status === 409 && !!error?.retryAfter);
+}
+
+/**
+ * Make a write request with the Idempotency-Key of the user action (one key
+ * per button press / submission, reused until the action resolves).
+ * Retries timeouts, network errors and 409 "still running" (sent with
+ * Retry-After) only: the backend answers them from its stored response.
+ * 5xx are not retried, the request may have written before failing.
+ */
+async function idempotentRequest<T>(
+  endpoint: string,
+  options: RequestInit,
+  idempotencyKey: string,
+  retries = 2
+): Promise<T> {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await apiRequest<T>(endpoint, {
+        ...options,
+        headers: { ...options.headers, 'Idempotency-Key': idempotencyKey },
+      });
+    } catch (error: any) {
+      const status: number | undefined = error?.status;
+      const retriable = status === undefined || (status === 409 && !!error?.retryAfter);
+      if (!retriable || attempt >= retries) {
+        throw error;
+      }
+      const retryAfterMs = Number(error?.retryAfter) * 1000 || 0;
+      await new Promise((resolve) => setTimeout(resolve, Math.max(300 * 2 ** attempt, retryAfterMs)));
+    }
+  }
+}
+
 // ============================================
 // FRIENDS API
 // ============================================
@@ -166,6 +211,21 @@ export const friendsApi = {
   },
 };
 
+// ============================================
+// PROFILES API
+// ============================================
+
+export const profilesApi = {
+  /**
+   * Invalidate the backend's cached display name after a profile update
+   */
+  async refreshProfile(): Promise<{ message: string }> {
+    return apiRequest('/api/profiles/me/refresh', {
+      method: 'POST',
+    });
+  },
+};
+
 // ============================================
 // DUELS API
 // ============================================
@@ -202,11 +262,15 @@ export const duelsApi = {
   /**
    * Create a new duel
    */
-  async createDuel(friendId: string, exerciseId?: number): Promise<{ message: string; duel_id: number; duel: Duel }> {
-    return apiRequest('/api/duels/create', {
+  async createDuel(
+    friendId: string,
+    idempotencyKey: string,
+    exerciseId?: number
+  ): Promise<{ message: string; duel_id: number; duel: Duel }> {
+    return idempotentRequest('/api/duels/create', {
       method: 'POST',
       body: JSON.stringify({ friend_id: friendId, exercise_id: exerciseId }),
-    });
+    }, idempotencyKey);
   },
 
   /**
@@ -256,9 +320,10 @@ export const duelsApi = {
     elementId: number,
     answer: string,
     isCorrect: boolean,
-    timeSpent: number
+    timeSpent: number,
+    idempotencyKey: string
   ): Promise<{ message: string; correct: boolean; new_score?: number; duel?: Duel }> {
-    return apiRequest(`/api/duels/${duelId}/submit`, {
+    return idempotentRequest(`/api/duels/${duelId}/submit`, {
       method: 'POST',
       body: JSON.stringify({
         duel_id: duelId,
@@ -267,6 +332,26 @@ export const duelsApi = {
         is_correct: isCorrect,
         time_spent: timeSpent,
       }),
-    });
+    }, idempotencyKey);
+  },
+
+  /**
+   * Submit answers for several elements of a duel in one request
+   */
+  async submitAnswers(
+    duelId: number,
+    answers: { element_id: number; answer: string; is_correct: boolean; time_spent: number }[],
+    idempotencyKey: string
+  ): Promise<{
+    message: string;
+    results: { element_id: number; correct: boolean }[];
+    correct_count: number;
+    new_score?: number;
+    duel: Duel;
+  }> {
+    return idempotentRequest(`/api/duels/${duelId}/submit-batch`, {
+      method: 'POST',
+      body: JSON.stringify({ answers }),
+    }, idempotencyKey);
   },
 };